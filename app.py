@@ -2,9 +2,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import joblib
-import matplotlib.pyplot as plt
+import io
 import time
-from tensorflow.keras.models import load_model
 
 st.set_page_config(page_title="Water Quality Analyzer", page_icon="💧")
 st.title("💧 Water Safety Dashboard")
@@ -21,21 +20,135 @@ with st.expander("ℹ️ WHO Guidelines & Key Indicators"):
     - **DO (Dissolved Oxygen)**: >6 mg/L preferred for freshness  
     """)
 
+# ---------------- Constants ----------------
+# Columns the app passes to the scaler/ANN
+FEATURE_COLUMNS = ["ec_val", "temp", "ph", "tds"]
+N_FEATURES = len(FEATURE_COLUMNS)
+
+# Fixed label set per status column, stored as pd.Categorical so counts
+# and membership tests work on integer codes
+STATUS_CATEGORIES = {
+    "ph_status": ["✅ OK", "⚠️ Out of Range"],
+    "tds_status": ["✅ OK", "⚠️ High"],
+    "ec_status": ["✅ OK", "⚠️ High"],
+    "coliform_status": ["✅ Safe", "🚨 Unsafe"],
+    "hardness_status": ["💧 Soft", "🧂 Moderate", "🪨 Hard", "⚠️ Very Hard"],
+    "do_status": ["✅ Good", "⚠️ Low"],
+}
+
+# Status labels counted as "within acceptable range" in the summary
+SAFE_VALUES = {"✅ OK", "✅ Safe", "✅ Good", "💧 Soft", "🧂 Moderate", "🪨 Hard"}
+
+# Pie slice colour per status label
+LABEL_COLOR = {
+    "✅ OK": "#4CAF50",
+    "✅ Safe": "#4CAF50",
+    "✅ Good": "#4CAF50",
+    "💧 Soft": "#4CAF50",
+    "🧂 Moderate": "#FFC107",
+    "🪨 Hard": "#FFC107",
+    "⚠️ Very Hard": "#FFC107",
+    "⚠️ Out of Range": "#FFC107",
+    "⚠️ High": "#FFC107",
+    "⚠️ Low": "#FFC107",
+    "🚨 Unsafe": "#F44336",
+}
+
+# Status column and title for each compliance pie chart
+CHARTS = [
+    ("ph_status", "pH Compliance"),
+    ("tds_status", "TDS Compliance"),
+    ("ec_status", "Electrical Conductivity"),
+    ("coliform_status", "Coliform Presence"),
+    ("hardness_status", "Water Hardness"),
+    ("do_status", "Dissolved Oxygen"),
+]
+
+# ---------------- Helper Functions ----------------
+def _draw_pie(ax, title, labels, sizes):
+    colors = [LABEL_COLOR.get(l, "#F44336") for l in labels]
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors)
+    ax.axis('equal')
+    ax.set_title(title)
+
 # ---------------- Caching Functions ----------------
 @st.cache_resource
 def load_model_cached():
+    from tensorflow.keras.models import load_model
     return load_model("water_quality_ann.h5")
 
+@st.cache_resource
+def load_predictor_cached():
+    # cache_resource doesn't cache exceptions, so the checks run before the
+    # graph is traced, and the scaler check before TensorFlow is imported
+    mean, scale = load_scaler_cached()
+    import tensorflow as tf
+    model = load_model_cached()
+    n_inputs = model.input_shape[-1]
+    if n_inputs != N_FEATURES:
+        raise ValueError(
+            f"water_quality_ann.h5 takes {n_inputs} inputs, but the app "
+            f"provides {N_FEATURES} ({', '.join(FEATURE_COLUMNS)})"
+        )
+    mean, scale = tf.constant(mean, dtype=tf.float32), tf.constant(scale, dtype=tf.float32)
+
+    # Fixed signature: one trace serves every batch size, and calling the
+    # model directly skips the per-call overhead of model.predict.
+    # Scaling and argmax run inside the same graph, so raw features go in
+    # and class indices come out.
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None, N_FEATURES], dtype=tf.float32)])
+    def predict(x):
+        return tf.argmax(model((x - mean) / scale, training=False), axis=1, output_type=tf.int32)
+
+    # Trace once here so the first prediction doesn't pay for it
+    return predict.get_concrete_function()
+
 @st.cache_resource
 def load_scaler_cached():
-    return joblib.load("scaler.pkl")
+    # StandardScaler reduced to its parameters; (X - mean) / scale skips
+    # sklearn's per-call input validation, so check the fitted features
+    # against FEATURE_COLUMNS once here instead
+    scaler = joblib.load("scaler.pkl")
+    names = getattr(scaler, "feature_names_in_", None)
+    if names is not None:
+        if [str(n).lower() for n in names] != FEATURE_COLUMNS:
+            raise ValueError(
+                f"scaler.pkl was fit on features {list(names)}, "
+                f"but the app provides {FEATURE_COLUMNS}"
+            )
+    elif scaler.n_features_in_ != N_FEATURES:
+        raise ValueError(
+            f"scaler.pkl expects {scaler.n_features_in_} features, "
+            f"but the app provides {N_FEATURES}"
+        )
+    return scaler.mean_.astype(np.float32), scaler.scale_.astype(np.float32)
+
+@st.cache_data(show_spinner=False)
+def read_csv_cached(data: bytes, index_col=None):
+    # Keyed on the uploaded bytes; UploadedFile objects change identity
+    # between reruns and can miss the cache
+    return pd.read_csv(io.BytesIO(data), index_col=index_col)
 
 @st.cache_data
-def read_csv_cached(file):
-    return pd.read_csv(file)
+def render_pies_cached(charts: tuple) -> bytes:
+    # charts: (title, labels, sizes) per pie, all drawn into one figure
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(2, 3, figsize=(12, 8))
+    axes = axes.ravel()
+    for ax, chart in zip(axes, charts):
+        _draw_pie(ax, *chart)
+    for ax in axes[len(charts):]:
+        ax.set_visible(False)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    return buf.getvalue()
 
 # ---------------- Mode Selection ----------------
 mode = st.radio("📌 Select Data Entry Mode", ["Upload CSV Files", "Manual Input"])
+run_ai = st.checkbox("🧠 Run AI models", value=True, key="run_ai")
 
 if mode == "Upload CSV Files":
     phys_file = st.file_uploader("Upload Physical Parameter CSV", type=["csv"])
@@ -43,40 +156,59 @@ if mode == "Upload CSV Files":
 
     if phys_file and bact_file:
         start = time.time()
-        phys_df = read_csv_cached(phys_file)
-        bact_df = read_csv_cached(bact_file)
+        phys_df = read_csv_cached(phys_file.getvalue(), index_col="Sample")
+        bact_df = read_csv_cached(bact_file.getvalue(), index_col="Sample")
         st.success("✅ Files uploaded!")
 
         try:
-            phys_df[['ec_val', 'temp']] = phys_df['EC'].str.split('/', expand=True).astype(float)
+            ec = phys_df['EC']
+            ec_parts = np.char.partition(ec.to_numpy(dtype=str), '/')
+            if not (ec_parts[:, 1] == '/').any():
+                raise ValueError("no 'value/temp' entries in EC")
+            # Blank cells and cells without '/' give NaN for the missing
+            # half, row by row, as str.split(expand=True) did
+            missing = ec.isna().to_numpy()
+            ec_val, temp = (
+                np.where(missing | (part == ''), 'nan', part).astype(float)
+                for part in (ec_parts[:, 0], ec_parts[:, 2])
+            )
+            phys_df['ec_val'] = ec_val
+            phys_df['temp'] = temp
         except Exception:
             st.error("⚠️ Unable to split 'EC'. Please ensure it's in 'value/temp' format (e.g., '1400/25').")
 
-        df = pd.merge(phys_df, bact_df, on="Sample", how="inner")
+        df = phys_df.join(bact_df, how="inner", lsuffix="_x", rsuffix="_y").reset_index()
         st.write(f"⏱️ Data processing time: {time.time() - start:.2f} seconds")
     else:
         df = None
 
 elif mode == "Manual Input":
     st.info("Enter water quality parameters for a single sample:")
-    pH = st.number_input("pH", 0.0, 14.0, step=0.01)
-    ec_val = st.number_input("Electrical Conductivity (µS/cm)", 0.0, step=1.0)
-    temp = st.number_input("Temperature (°C)", 0.0, 100.0, step=0.1)
-    tds = st.number_input("TDS (mg/L)", 0.0, step=1.0)
-    hardness = st.number_input("Hardness (mg/L as CaCO3)", 0.0, step=1.0)
-    do = st.number_input("Dissolved Oxygen (mg/L)", 0.0, step=0.1)
-    coliform = st.selectbox("Coliform presence", ["No", "Yes"])
-
-    df = pd.DataFrame({
-        "sample": ["ManualEntry1"],
-        "ph": [pH],
-        "ec_val": [ec_val],
-        "temp": [temp],
-        "tds": [tds],
-        "hardness": [hardness],
-        "do": [do],
-        "coliform": [0 if coliform == "No" else 1]
-    })
+    with st.form("manual_input"):
+        pH = st.number_input("pH", 0.0, 14.0, step=0.01)
+        ec_val = st.number_input("Electrical Conductivity (µS/cm)", 0.0, step=1.0)
+        temp = st.number_input("Temperature (°C)", 0.0, 100.0, step=0.1)
+        tds = st.number_input("TDS (mg/L)", 0.0, step=1.0)
+        hardness = st.number_input("Hardness (mg/L as CaCO3)", 0.0, step=1.0)
+        do = st.number_input("Dissolved Oxygen (mg/L)", 0.0, step=0.1)
+        coliform = st.selectbox("Coliform presence", ["No", "Yes"])
+        submitted = st.form_submit_button("Analyze")
+
+    # Edits only rerun the analysis on submit; the last submitted sample is
+    # kept so other widget interactions don't clear the results
+    if submitted:
+        st.session_state["manual_sample"] = {
+            "sample": ["ManualEntry1"],
+            "ph": [pH],
+            "ec_val": [ec_val],
+            "temp": [temp],
+            "tds": [tds],
+            "hardness": [hardness],
+            "do": [do],
+            "coliform": [0 if coliform == "No" else 1]
+        }
+    sample = st.session_state.get("manual_sample")
+    df = pd.DataFrame(sample) if sample is not None else None
 
 # ---------------- Process if Data Available ----------------
 if df is not None and not df.empty:
@@ -84,60 +216,51 @@ if df is not None and not df.empty:
 
     # WHO Checks
     if 'ph' in df.columns:
-        df["ph_status"] = df["ph"].apply(lambda x: "✅ OK" if 6.5 <= x <= 7.5 else "⚠️ Out of Range")
+        df["ph_status"] = np.where((df["ph"] >= 6.5) & (df["ph"] <= 7.5), "✅ OK", "⚠️ Out of Range")
     if 'tds' in df.columns:
-        df["tds_status"] = df["tds"].apply(lambda x: "✅ OK" if x <= 300 else "⚠️ High")
+        df["tds_status"] = np.where(df["tds"] <= 300, "✅ OK", "⚠️ High")
     if 'ec_val' in df.columns:
-        df["ec_status"] = df["ec_val"].apply(lambda x: "✅ OK" if x <= 400 else "⚠️ High")
+        df["ec_status"] = np.where(df["ec_val"] <= 400, "✅ OK", "⚠️ High")
     if 'coliform' in df.columns:
-        df["coliform_status"] = df["coliform"].apply(lambda x: "✅ Safe" if x == 0 else "🚨 Unsafe")
+        df["coliform_status"] = np.where(df["coliform"].to_numpy() == 0, "✅ Safe", "🚨 Unsafe")
     if "hardness" in df.columns:
-        df["hardness_status"] = df["hardness"].apply(
-            lambda x: "💧 Soft" if x <= 60 else
-                      "🧂 Moderate" if x <= 120 else
-                      "🪨 Hard" if x <= 180 else
-                      "⚠️ Very Hard"
+        hardness = df["hardness"]
+        df["hardness_status"] = np.select(
+            [hardness <= 60, hardness <= 120, hardness <= 180],
+            ["💧 Soft", "🧂 Moderate", "🪨 Hard"],
+            default="⚠️ Very Hard"
         )
     if "do" in df.columns:
-        df["do_status"] = df["do"].apply(lambda x: "✅ Good" if x >= 6 else "⚠️ Low")
+        df["do_status"] = np.where(df["do"] >= 6, "✅ Good", "⚠️ Low")
+    for col, categories in STATUS_CATEGORIES.items():
+        if col in df.columns:
+            df[col] = pd.Categorical(df[col], categories=categories)
 
-    # AI prediction
-    try:
-        start = time.time()
-        model = load_model_cached()
-        scaler = load_scaler_cached()
-        features = df[["ec_val", "temp", "ph", "tds"]]
-        X_scaled = scaler.transform(features)
-        prediction = model.predict(X_scaled)
-        df["prediction"] = np.argmax(prediction, axis=1)
-        df["interpretation"] = df["prediction"].map({0: "Good", 1: "Moderate", 2: "Poor"})
-        st.success("🧠 AI predictions generated!")
-        st.write(f"⏱️ Prediction time: {time.time() - start:.2f} seconds")
-    except Exception as e:
-        st.warning(f"⚠️ Model/scaler issue: {e}")
-        df["interpretation"] = "Unavailable"
-
-    # Pie chart function
-    def pie_chart(col, title):
+    # AI prediction (skipped when only WHO compliance is wanted)
+    if run_ai:
+        try:
+            start = time.time()
+            predict = load_predictor_cached()
+            import tensorflow as tf
+            features = df[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+            df["prediction"] = predict(tf.constant(features, dtype=tf.float32)).numpy()
+            df["interpretation"] = df["prediction"].map({0: "Good", 1: "Moderate", 2: "Poor"})
+            st.success("🧠 AI predictions generated!")
+            st.write(f"⏱️ Prediction time: {time.time() - start:.2f} seconds")
+        except Exception as e:
+            st.warning(f"⚠️ Model/scaler issue: {e}")
+            df["interpretation"] = "Unavailable"
+
+    # Pie charts
+    charts = []
+    for col, title in CHARTS:
         if col in df.columns:
             counts = df[col].value_counts()
-            labels = counts.index.tolist()
-            sizes = counts.values.tolist()
-            colors = ["#4CAF50" if "✅" in l or "💧" in l else
-                      "#FFC107" if "⚠️" in l or "🧂" in l or "🪨" in l else
-                      "#F44336" for l in labels]
-            fig, ax = plt.subplots()
-            ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors)
-            ax.axis('equal')
-            st.subheader(f"📊 {title}")
-            st.pyplot(fig)
-
-    pie_chart("ph_status", "pH Compliance")
-    pie_chart("tds_status", "TDS Compliance")
-    pie_chart("ec_status", "Electrical Conductivity")
-    pie_chart("coliform_status", "Coliform Presence")
-    pie_chart("hardness_status", "Water Hardness")
-    pie_chart("do_status", "Dissolved Oxygen")
+            counts = counts[counts > 0]
+            charts.append((title, tuple(counts.index), tuple(counts.values.tolist())))
+    if charts:
+        st.subheader("📊 Compliance Overview")
+        st.image(render_pies_cached(tuple(charts)))
 
     # Advisory
     if "🚨 Unsafe" in df.get("coliform_status", []):
@@ -158,7 +281,7 @@ if df is not None and not df.empty:
     for col in param_columns:
         if col in df.columns:
             total = len(df)
-            safe = df[col].str.contains("✅|💧|🧂|🪨").sum()
+            safe = df[col].isin(SAFE_VALUES).sum()
             st.markdown(f"**{col.replace('_status','').upper()}**: {safe/total*100:.1f}% samples within acceptable range.")
 
 else: